@@ -15,6 +15,7 @@ Author: Socket Programming Assignment
 """
 
 import socket
+import selectors
 import threading
 import os
 import sys
@@ -22,19 +23,161 @@ import json
 import time
 import re
 import logging
-from datetime import datetime
+import signal
+import stat
+import email.utils
 from urllib.parse import unquote
 from queue import Queue, Empty
-import mimetypes
 import hashlib
-import random
+import functools
+from collections import OrderedDict
 from pathlib import Path
 
+# orjson is optional: parse and serialize JSON in C when it's installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads_json(data):
+    """Parse JSON from request body bytes, accepting exactly what the json module accepts"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # orjson is stricter (e.g. NaN/Infinity), so let json decide
+    return json.loads(data)
+
+
+def dumps_json(obj):
+    """Serialize to 2-space indented JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode()
+
+
+# Content-Length header in a raw header block (the request line always precedes it)
+_CONTENT_LENGTH = re.compile(rb'\r\ncontent-length:[ \t]*(\d+)[ \t]*\r\n', re.IGNORECASE)
+
+# (unix second, RFC 7231 date bytes) last produced by get_http_date
+_date_cache = (0, b"")
+
+@functools.lru_cache(maxsize=1024)
+def _file_validators(size, mtime_ns):
+    """(ETag, ETag/Last-Modified header bytes) for a file version, formatted once per size/mtime"""
+    etag = f'"{size:x}-{mtime_ns:x}"'
+    last_modified = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(mtime_ns // 1_000_000_000))
+    return etag, f"ETag: {etag}\r\nLast-Modified: {last_modified}\r\n".encode()
+
+# Headers read on every request, stored directly on Request: (lower-case "name:" prefix, attribute)
+_KNOWN_HEADERS = (
+    (b'host:', 'host'),
+    (b'connection:', 'connection'),
+    (b'content-type:', 'content_type'),
+)
+_KNOWN_HEADER_PREFIX_SIZE = max(len(needle) for needle, _ in _KNOWN_HEADERS)
+
+
+class RequestTooLarge(Exception):
+    """Request headers or body over the server's size limits"""
+    
+    def __init__(self, status_code, status_text, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.status_text = status_text
+
+
+class LazyHeaders:
+    """Request headers kept as raw byte lines, only split and decoded when looked up"""
+    
+    __slots__ = ('lines', '_parsed')
+    
+    def __init__(self, lines):
+        self.lines = lines
+        self._parsed = None
+    
+    def get(self, name, default=None):
+        """Return the value of a header (case-insensitive name) or default"""
+        needle = name.lower().encode() + b':'
+        
+        # Compare only the line prefix, so lines for other headers are never decoded
+        size = len(needle)
+        for line in self.lines:
+            if line[:size].lower() == needle:
+                return line[size:].strip().decode('utf-8', errors='ignore')
+        return default
+    
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+    
+    def __contains__(self, name):
+        return self.get(name) is not None
+    
+    def to_dict(self):
+        """Parse every header into a {lower-case name: value} dictionary"""
+        if self._parsed is None:
+            headers = {}
+            for line in self.lines:
+                if b':' in line:
+                    key, value = line.split(b':', 1)
+                    headers[key.strip().lower().decode('utf-8', errors='ignore')] = value.strip().decode('utf-8', errors='ignore')
+            self._parsed = headers
+        return self._parsed
+
+
+class Request:
+    """Parsed HTTP request
+    
+    The headers every request needs are plain attributes; any other header
+    is looked up through the lazily parsed headers.
+    """
+    
+    __slots__ = (
+        'method', 'path', 'version', 'headers', 'body',
+        'host', 'connection', 'content_type',
+    )
+    
+    def __init__(self, method, path, version, headers, body):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self.host = ''
+        self.connection = ''
+        self.content_type = ''
+
 
 class HTTPServer:
     """Multi-threaded HTTP Server implementation"""
     
-    def __init__(self, host='127.0.0.1', port=8080, max_threads=10):
+    # Fixed response header fragments, encoded once
+    _RESP_200 = b"HTTP/1.1 200 OK\r\n"
+    _RESP_201 = b"HTTP/1.1 201 Created\r\n"
+    _RESP_304 = b"HTTP/1.1 304 Not Modified\r\n"
+    _CONN_KEEP_ALIVE = b"Connection: keep-alive\r\nKeep-Alive: timeout=30, max=100\r\n"
+    _CONN_CLOSE = b"Connection: close\r\n"
+    _TYPE_HTML = b"text/html; charset=utf-8"
+    _TYPE_BINARY = b"application/octet-stream"
+    _TYPE_JSON = b"application/json"
+    
+    # Servable file extensions: (Content-Type, sent as a download)
+    _EXT_MAP = {
+        '.html': (_TYPE_HTML, False),
+        '.txt': (_TYPE_BINARY, True),
+        '.png': (_TYPE_BINARY, True),
+        '.jpg': (_TYPE_BINARY, True),
+        '.jpeg': (_TYPE_BINARY, True),
+    }
+    
+    # Explicit Connection header values and whether they keep the connection open
+    _CONNECTION_KEEP_ALIVE = {'close': False, 'keep-alive': True}
+    
+    def __init__(self, host='127.0.0.1', port=8080, max_threads=10, processes=1):
         """Initialize the HTTP server"""
         self.host = host
         self.port = port
@@ -42,20 +185,51 @@ class HTTPServer:
         self.server_socket = None
         self.running = False
         
+        # Prefork worker processes (each with its own listening socket and thread pool)
+        self.processes = processes
+        self.child_pids = []
+        
         # Thread pool management
         self.thread_pool = []
         self.connection_queue = Queue()
         self.active_connections = 0
         self.connections_lock = threading.Lock()
         
+        # Idle keep-alive connections handed back by workers to the acceptor's selector
+        self.parked_connections = Queue()
+        self.wakeup_recv = None
+        self.wakeup_send = None
+        
+        # Valid Host header values, computed once rather than per request
+        valid_hosts = {f"{host}:{port}", f"localhost:{port}", f"127.0.0.1:{port}"}
+        if port == 80:
+            valid_hosts |= {host, "localhost", "127.0.0.1"}
+        self.valid_hosts = frozenset(valid_hosts)
+        
+        # Request handlers by HTTP method (anything else gets 405)
+        self.method_handlers = {
+            'GET': self.handle_get_request,
+            'POST': self.handle_post_request,
+        }
+        
         # Server info
         self.server_name = "Multi-threaded HTTP Server"
+        self.server_header = f"Server: {self.server_name}\r\n".encode()
         self.resources_dir = os.path.join(os.path.dirname(__file__), 'resources')
         self.uploads_dir = os.path.join(self.resources_dir, 'uploads')
+        # Canonical resources directory that every served file must resolve inside
+        self.resources_root = os.path.realpath(self.resources_dir)
         
         # Ensure directories exist
         os.makedirs(self.uploads_dir, exist_ok=True)
         
+        # Static file cache: file_path -> (mtime_ns, content), least recently used first
+        self.file_cache = OrderedDict()
+        self.file_cache_bytes = 0
+        self.file_cache_max_bytes = 32 * 1024 * 1024  # 32MB total
+        self.file_cache_max_entry = 1024 * 1024  # Larger files are always sent with sendfile
+        self.file_cache_lock = threading.Lock()
+        
         # Setup logging
         self.setup_logging()
         
@@ -90,19 +264,30 @@ class HTTPServer:
     def start(self):
         """Start the HTTP server"""
         try:
-            # Create socket
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.processes > 1 and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')):
+                self.log("Multiple processes need fork() and SO_REUSEPORT, running a single process")
+                self.processes = 1
             
-            # Bind and listen
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(50)  # Queue size of 50 as specified
+            # Create socket, bind and listen
+            self.server_socket = self.create_server_socket()
+            
+            # Fork the extra worker processes before any threads exist
+            if self.processes > 1:
+                signal.signal(signal.SIGTERM, self.handle_sigterm)
+                self.fork_workers()
+            
+            # Socket pair used by workers to wake the selector when they park a connection
+            self.wakeup_recv, self.wakeup_send = socket.socketpair()
+            self.wakeup_recv.setblocking(False)
+            self.wakeup_send.setblocking(False)
             
             self.running = True
             
             # Log startup
             self.log(f"HTTP Server started on http://{self.host}:{self.port}")
             self.log(f"Thread pool size: {self.max_threads}")
+            if self.processes > 1:
+                self.log(f"Worker processes: {self.processes} (pid {os.getpid()})")
             self.log(f"Serving files from '{self.resources_dir}' directory")
             self.log("Press Ctrl+C to stop the server")
             
@@ -119,6 +304,37 @@ class HTTPServer:
         finally:
             self.stop()
     
+    def create_server_socket(self):
+        """Create the listening socket"""
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        
+        if self.processes > 1:
+            # Every process binds its own socket to the port; the kernel spreads connections across them
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        
+        # Bind and listen
+        server_socket.bind((self.host, self.port))
+        server_socket.listen(50)  # Queue size of 50 as specified
+        return server_socket
+    
+    def fork_workers(self):
+        """Fork processes - 1 children that serve the same port through SO_REUSEPORT"""
+        for _ in range(self.processes - 1):
+            pid = os.fork()
+            if pid == 0:
+                # Child: replace the inherited socket with one of its own and fork nothing further
+                self.child_pids = []
+                self.server_socket.close()
+                self.server_socket = self.create_server_socket()
+                return
+            
+            self.child_pids.append(pid)
+    
+    def handle_sigterm(self, signum, frame):
+        """Shut down on SIGTERM the same way as on Ctrl+C"""
+        raise KeyboardInterrupt
+    
     def start_thread_pool(self):
         """Initialize the worker thread pool"""
         for i in range(self.max_threads):
@@ -139,7 +355,7 @@ class HTTPServer:
         while self.running:
             try:
                 # Get connection from queue (timeout to check running status)
-                client_socket, client_address = self.connection_queue.get(timeout=1)
+                client_socket, client_address, connection_count = self.connection_queue.get(timeout=1)
                 
                 if client_socket is None:  # Shutdown signal
                     break
@@ -147,10 +363,11 @@ class HTTPServer:
                 with self.connections_lock:
                     self.active_connections += 1
                 
-                self.log(f"Connection from {client_address[0]}:{client_address[1]}", thread_name)
+                if connection_count == 0:
+                    self.log(f"Connection from {client_address[0]}:{client_address[1]}", thread_name)
                 
-                # Handle the connection with keep-alive support
-                self.handle_client_connection(client_socket, client_address, thread_name)
+                # Serve the waiting request; keep-alive connections are parked again afterwards
+                self.handle_client_connection(client_socket, client_address, thread_name, connection_count)
                 
             except Empty:
                 # Queue timeout - continue to check running status
@@ -163,181 +380,279 @@ class HTTPServer:
                         self.active_connections -= 1
     
     def accept_connections(self):
-        """Accept incoming client connections"""
-        while self.running:
-            try:
-                client_socket, client_address = self.server_socket.accept()
-                
-                # Check if thread pool is saturated
-                if self.connection_queue.qsize() >= self.max_threads * 2:
-                    self.log("Warning: Thread pool saturated, queuing connection")
-                
-                # Add connection to queue
-                self.connection_queue.put((client_socket, client_address))
+        """Accept new connections and watch idle connections in one selector loop
+        
+        Connections only reach the worker queue once they have a request to read,
+        so idle keep-alive clients don't tie up worker threads.
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self.server_socket, selectors.EVENT_READ)
+        selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        last_sweep = time.monotonic()
+        
+        try:
+            while self.running:
+                for key, _ in selector.select(timeout=1):
+                    if key.fileobj is self.server_socket:
+                        if not self.accept_connection(selector):
+                            return
+                    elif key.fileobj is self.wakeup_recv:
+                        self.register_parked_connections(selector)
+                    else:
+                        # Request data (or a close) arrived: hand the connection to a worker
+                        selector.unregister(key.fileobj)
+                        client_address, connection_count, _ = key.data
+                        self.queue_connection(key.fileobj, client_address, connection_count)
                 
-            except socket.error as e:
-                if self.running:
-                    self.log(f"Accept error: {e}")
+                now = time.monotonic()
+                if now - last_sweep >= 1:
+                    self.close_idle_connections(selector, now)
+                    last_sweep = now
+        finally:
+            for key in list(selector.get_map().values()):
+                if key.data is not None:
+                    key.fileobj.close()
+            selector.close()
+    
+    def accept_connection(self, selector):
+        """Accept one incoming client connection and watch it for its first request"""
+        try:
+            client_socket, client_address = self.server_socket.accept()
+        except socket.error as e:
+            if self.running:
+                self.log(f"Accept error: {e}")
+            return False
+        
+        # Responses are written in as few calls as possible, so don't let Nagle delay them
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        
+        selector.register(client_socket, selectors.EVENT_READ, (client_address, 0, time.monotonic()))
+        return True
+    
+    def queue_connection(self, client_socket, client_address, connection_count):
+        """Queue a connection with a pending request for the worker threads"""
+        # Check if thread pool is saturated
+        if self.connection_queue.qsize() >= self.max_threads * 2:
+            self.log("Warning: Thread pool saturated, queuing connection")
+        
+        # Add connection to queue
+        self.connection_queue.put((client_socket, client_address, connection_count))
+    
+    def park_connection(self, client_socket, client_address, connection_count):
+        """Hand an idle keep-alive connection back to the selector (called from worker threads)"""
+        self.parked_connections.put((client_socket, client_address, connection_count))
+        try:
+            self.wakeup_send.send(b"\0")
+        except socket.error:
+            pass  # Wakeup buffer full: the selector is already due to drain the parked queue
+    
+    def register_parked_connections(self, selector):
+        """Watch connections parked by workers for their next request"""
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except socket.error:
+            pass
+        
+        while True:
+            try:
+                client_socket, client_address, connection_count = self.parked_connections.get_nowait()
+            except Empty:
                 break
+            selector.register(client_socket, selectors.EVENT_READ, (client_address, connection_count, time.monotonic()))
     
-    def handle_client_connection(self, client_socket, client_address, thread_name):
-        """Handle a client connection with keep-alive support"""
-        connection_count = 0
+    def close_idle_connections(self, selector, now):
+        """Close connections that have been idle longer than the keep-alive timeout"""
+        for key in list(selector.get_map().values()):
+            if key.data is None:
+                continue
+            
+            client_address, connection_count, idle_since = key.data
+            if now - idle_since > 30:  # 30 second timeout
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                self.log(f"Connection timeout: {client_address[0]}:{client_address[1]} ({connection_count} requests served)")
+    
+    def handle_client_connection(self, client_socket, client_address, thread_name, connection_count=0):
+        """Handle the next request on a client connection with keep-alive support"""
         max_requests = 100  # Maximum requests per connection
+        keep_alive = False
         
         try:
             client_socket.settimeout(30)  # 30 second timeout
             
-            while connection_count < max_requests and self.running:
-                try:
-                    # Receive request
-                    request_data = self.receive_request(client_socket)
-                    if not request_data:
-                        break  # Client closed connection
-                    
-                    connection_count += 1
-                    
-                    # Parse request
-                    request = self.parse_request(request_data)
-                    if not request:
-                        self.send_error_response(client_socket, 400, "Bad Request")
-                        break
-                    
-                    # Log request
-                    self.log(f"Request: {request['method']} {request['path']} {request['version']}", thread_name)
-                    
-                    # Validate host header (security requirement)
-                    if not self.validate_host_header(request, client_socket, thread_name):
-                        break
-                    
-                    # Handle the request
-                    keep_alive = self.handle_request(request, client_socket, thread_name, connection_count, max_requests)
-                    
-                    if not keep_alive:
-                        break
-                        
-                except socket.timeout:
-                    self.log(f"Connection timeout", thread_name)
-                    break
-                except ConnectionResetError:
-                    self.log(f"Client disconnected", thread_name)
-                    break
-                except Exception as e:
-                    self.log(f"Request handling error: {e}", thread_name)
-                    try:
-                        self.send_error_response(client_socket, 500, "Internal Server Error")
-                    except:
-                        pass
-                    break
-        
-        finally:
+            # Receive request
+            request_data = self.receive_request(client_socket)
+            if request_data:  # Otherwise the client closed the connection
+                connection_count += 1
+                keep_alive = self.process_request(request_data, client_socket, thread_name, connection_count, max_requests)
+                
+        except socket.timeout:
+            self.log(f"Connection timeout", thread_name)
+        except RequestTooLarge as e:
+            self.log(f"Rejected request: {e}", thread_name)
+            self.reject_request(client_socket, e)
+        except ConnectionResetError:
+            self.log(f"Client disconnected", thread_name)
+        except Exception as e:
+            self.log(f"Request handling error: {e}", thread_name)
             try:
-                client_socket.close()
-                self.log(f"Connection closed ({connection_count} requests served)", thread_name)
+                self.send_error_response(client_socket, 500, "Internal Server Error")
             except:
                 pass
+        
+        if keep_alive and connection_count < max_requests and self.running:
+            # Wait for the next request in the selector rather than in this worker
+            self.park_connection(client_socket, client_address, connection_count)
+            return
+        
+        try:
+            client_socket.close()
+            self.log(f"Connection closed ({connection_count} requests served)", thread_name)
+        except:
+            pass
+    
+    def reject_request(self, client_socket, error):
+        """Answer an oversized request with its error status, then drain what the client is still sending"""
+        self.send_error_response(client_socket, error.status_code, error.status_text, str(error))
+        
+        # Closing with unread input would reset the connection before the client
+        # reads the response, so half-close and discard input briefly first
+        try:
+            client_socket.shutdown(socket.SHUT_WR)
+            client_socket.settimeout(2)
+            discarded = 0
+            while discarded < 4 * 1024 * 1024:
+                received = client_socket.recv(65536)
+                if not received:
+                    break
+                discarded += len(received)
+        except socket.error:
+            pass
+    
+    def process_request(self, request_data, client_socket, thread_name, connection_count, max_requests):
+        """Parse, validate and handle one request; return whether to keep the connection alive"""
+        # Parse request
+        request = self.parse_request(request_data)
+        if not request:
+            self.send_error_response(client_socket, 400, "Bad Request")
+            return False
+        
+        # Log request
+        self.log(f"Request: {request.method} {request.path} {request.version}", thread_name)
+        
+        # Validate host header (security requirement)
+        if not self.validate_host_header(request, client_socket, thread_name):
+            return False
+        
+        # Handle the request
+        return self.handle_request(request, client_socket, thread_name, connection_count, max_requests)
     
     def receive_request(self, client_socket):
-        """Receive and parse HTTP request data"""
-        request_data = b""
+        """Receive HTTP request: read up to the end of the headers, then exactly Content-Length body bytes"""
+        # Preallocated buffer filled in place with recv_into (8KB headers + slack)
+        buffer = bytearray(8192 + 1024)
+        view = memoryview(buffer)
+        filled = 0
+        total = None
         
-        while True:
-            try:
-                # Receive data in chunks
-                chunk = client_socket.recv(8192)
-                if not chunk:
+        try:
+            # Read until the blank line that terminates the headers
+            headers_end = -1
+            while headers_end < 0:
+                if filled == len(buffer):
+                    raise RequestTooLarge(431, "Request Header Fields Too Large",
+                                          f"Request headers exceed {len(buffer)} bytes")
+                
+                received = client_socket.recv_into(view[filled:])
+                if not received:
                     break
+                filled += received
                 
-                request_data += chunk
+                # Only scan the new bytes, plus 3 bytes of overlap for a terminator split across reads
+                headers_end = buffer.find(b'\r\n\r\n', max(0, filled - received - 3), filled)
+            
+            if headers_end >= 0:
+                headers_end += 4
+                content_length = self.extract_content_length(view[:headers_end])
                 
-                # Check if we have received the full headers
-                if b'\r\n\r\n' in request_data:
-                    # Split headers and body
-                    headers_end = request_data.find(b'\r\n\r\n')
-                    headers = request_data[:headers_end + 4]
-                    body_received = request_data[headers_end + 4:]
-                    
-                    # Check if we need to receive more body data
-                    headers_str = headers.decode('utf-8', errors='ignore')
-                    content_length = self.extract_content_length(headers_str)
-                    
-                    if content_length > 0:
-                        # Receive remaining body data
-                        while len(body_received) < content_length:
-                            remaining = content_length - len(body_received)
-                            chunk = client_socket.recv(min(remaining, 8192))
-                            if not chunk:
-                                break
-                            body_received += chunk
-                    
-                    return headers + body_received
+                # Prevent oversized bodies (1MB max)
+                if content_length > 1024 * 1024:
+                    raise RequestTooLarge(413, "Payload Too Large",
+                                          f"Request body of {content_length} bytes exceeds 1MB limit")
                 
-                # Prevent oversized requests
-                if len(request_data) > 8192 + 1024*1024:  # 8KB headers + 1MB body max
-                    break
-                    
-            except socket.timeout:
-                break
-            except Exception:
-                break
+                total = headers_end + content_length
+                if total > len(buffer):
+                    # Grow once to the exact request size (the view must be released to resize)
+                    view.release()
+                    buffer.extend(bytes(total - len(buffer)))
+                    view = memoryview(buffer)
+                
+                # Read the rest of the body directly into the buffer
+                while filled < total:
+                    received = client_socket.recv_into(view[filled:total])
+                    if not received:
+                        break
+                    filled += received
+                
+        except socket.timeout:
+            pass
+        except RequestTooLarge:
+            view.release()
+            raise
+        except Exception:
+            pass
         
-        return request_data if request_data else None
+        view.release()
+        # Drop anything past the end of this request
+        del buffer[min(filled, total) if total is not None else filled:]
+        return buffer if buffer else None
     
-    def extract_content_length(self, headers_str):
-        """Extract Content-Length from headers"""
-        try:
-            for line in headers_str.split('\r\n'):
-                if line.lower().startswith('content-length:'):
-                    return int(line.split(':', 1)[1].strip())
-        except:
-            pass
-        return 0
+    def extract_content_length(self, headers_bytes):
+        """Extract Content-Length from the raw header bytes"""
+        match = _CONTENT_LENGTH.search(headers_bytes)
+        return int(match.group(1)) if match else 0
     
     def parse_request(self, request_data):
-        """Parse HTTP request and return request dictionary"""
+        """Parse HTTP request and return a Request (headers are parsed lazily)"""
         try:
-            request_str = request_data.decode('utf-8', errors='ignore')
+            # Split headers and body without decoding the whole request
+            headers_part, _, body = request_data.partition(b'\r\n\r\n')
             
-            # Split headers and body
-            if '\r\n\r\n' in request_str:
-                headers_part, body = request_str.split('\r\n\r\n', 1)
-            else:
-                headers_part = request_str
-                body = ""
-            
-            lines = headers_part.split('\r\n')
-            if not lines:
-                return None
+            lines = headers_part.split(b'\r\n')
             
             # Parse request line
-            request_line = lines[0]
-            parts = request_line.split()
+            parts = lines[0].decode('utf-8', errors='ignore').split()
             if len(parts) != 3:
                 return None
             
             method, path, version = parts
             
-            # Parse headers
-            headers = {}
-            for line in lines[1:]:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    headers[key.strip().lower()] = value.strip()
-            
-            return {
-                'method': method.upper(),
-                'path': unquote(path),  # URL decode the path
-                'version': version,
-                'headers': headers,
-                'body': body
-            }
+            header_lines = lines[1:]
+            request = Request(
+                method.upper(),
+                unquote(path),  # URL decode the path
+                version,
+                LazyHeaders(header_lines),
+                body
+            )
+            
+            # Single pass over the header lines for the headers used on every request
+            for line in header_lines:
+                prefix = line[:_KNOWN_HEADER_PREFIX_SIZE].lower()
+                for needle, attribute in _KNOWN_HEADERS:
+                    if prefix.startswith(needle):
+                        setattr(request, attribute, line[len(needle):].strip().decode('utf-8', errors='ignore'))
+                        break
+            
+            return request
             
         except Exception:
             return None
     
     def validate_host_header(self, request, client_socket, thread_name):
         """Validate Host header for security"""
-        host_header = request['headers'].get('host', '')
+        host_header = request.host
         
         if not host_header:
             self.log("Security violation: Missing Host header", thread_name)
@@ -345,16 +660,7 @@ class HTTPServer:
             return False
         
         # Valid hosts include localhost and the server's IP with correct port
-        valid_hosts = [
-            f"{self.host}:{self.port}",
-            f"localhost:{self.port}",
-            f"127.0.0.1:{self.port}"
-        ]
-        
-        if self.port == 80:
-            valid_hosts.extend([self.host, "localhost", "127.0.0.1"])
-        
-        if host_header not in valid_hosts:
+        if host_header not in self.valid_hosts:
             self.log(f"Security violation: Invalid Host header: {host_header}", thread_name)
             self.send_error_response(client_socket, 403, "Forbidden", "Invalid Host header")
             return False
@@ -364,18 +670,17 @@ class HTTPServer:
     
     def handle_request(self, request, client_socket, thread_name, connection_count, max_requests):
         """Handle HTTP request and return whether to keep connection alive"""
-        method = request['method']
-        path = request['path']
+        method = request.method
+        path = request.path
         
         try:
-            if method == 'GET':
-                return self.handle_get_request(request, client_socket, thread_name, connection_count, max_requests)
-            elif method == 'POST':
-                return self.handle_post_request(request, client_socket, thread_name, connection_count, max_requests)
-            else:
+            handler = self.method_handlers.get(method)
+            if handler is None:
                 self.send_error_response(client_socket, 405, "Method Not Allowed", f"Method {method} is not supported")
                 return False
-                
+            
+            return handler(request, client_socket, thread_name, connection_count, max_requests)
+            
         except Exception as e:
             self.log(f"Error handling {method} {path}: {e}", thread_name)
             self.send_error_response(client_socket, 500, "Internal Server Error")
@@ -383,32 +688,73 @@ class HTTPServer:
     
     def handle_get_request(self, request, client_socket, thread_name, connection_count, max_requests):
         """Handle GET request for files"""
-        path = request['path']
+        path = request.path
         
-        # Security: Validate and sanitize path
+        # Security: Validate and sanitize path, then make sure it resolves inside resources
         safe_path = self.validate_and_sanitize_path(path)
-        if not safe_path:
+        file_path = self.resolve_resource_path(safe_path) if safe_path else None
+        if not file_path:
             self.log(f"Security violation: Path traversal attempt: {path}", thread_name)
             self.send_error_response(client_socket, 403, "Forbidden", "Access denied")
             return False
         
-        file_path = os.path.join(self.resources_dir, safe_path)
+        # Check if file exists (one stat also gives the size and mtime used below)
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            file_stat = None
         
-        # Check if file exists
-        if not os.path.exists(file_path) or not os.path.isfile(file_path):
+        if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
             self.send_error_response(client_socket, 404, "Not Found", f"File {path} not found")
             return self.should_keep_alive(request, connection_count, max_requests)
         
         # Get file extension to determine content type
         _, ext = os.path.splitext(file_path.lower())
         
-        if ext == '.html':
-            return self.serve_html_file(file_path, client_socket, thread_name, request, connection_count, max_requests)
-        elif ext in ['.txt', '.png', '.jpg', '.jpeg']:
-            return self.serve_binary_file(file_path, client_socket, thread_name, request, connection_count, max_requests)
-        else:
+        file_type = self._EXT_MAP.get(ext)
+        if file_type is None:
             self.send_error_response(client_socket, 415, "Unsupported Media Type", f"File type {ext} not supported")
             return self.should_keep_alive(request, connection_count, max_requests)
+        
+        # Conditional GET: reply 304 with no body when the client's copy is current
+        etag, cache_headers = self.file_validators(file_stat)
+        
+        if self.is_not_modified(request, file_stat, etag):
+            self.send_not_modified_response(client_socket, cache_headers, request, connection_count, max_requests)
+            self.log(f"Response: 304 Not Modified ({os.path.basename(file_path)})", thread_name)
+            return self.should_keep_alive(request, connection_count, max_requests)
+        
+        content_type, is_download = file_type
+        return self.serve_file(file_path, file_stat, content_type, is_download, cache_headers, client_socket, thread_name, request, connection_count, max_requests)
+    
+    def file_validators(self, file_stat):
+        """Return the ETag and the ETag/Last-Modified header bytes for a file's stat result"""
+        return _file_validators(file_stat.st_size, file_stat.st_mtime_ns)
+    
+    def is_not_modified(self, request, file_stat, etag):
+        """Check If-None-Match / If-Modified-Since against the file's validators"""
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match is not None:
+            # If-None-Match takes precedence over If-Modified-Since
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f"W/{etag}" in tags
+        
+        if_modified_since = request.headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            
+            # Ignore dates that are not valid HTTP-dates (no GMT zone) or lie in the future
+            if since.tzinfo is None:
+                return False
+            since = since.timestamp()
+            if since > time.time():
+                return False
+            return int(file_stat.st_mtime) <= since
+        
+        return False
     
     def validate_and_sanitize_path(self, path):
         """Validate and sanitize file path to prevent directory traversal"""
@@ -420,95 +766,116 @@ class HTTPServer:
         if path == '' or path == '/':
             path = 'index.html'
         
-        # Security checks
-        if '..' in path or path.startswith('/') or '\\' in path:
+        # Security checks: no parent references, ./ or /. segments, absolute paths or backslashes
+        if '..' in path or './' in path or '/.' in path or path.startswith('/') or '\\' in path:
             return None
         
-        # Additional security: ensure path doesn't contain suspicious patterns
-        if re.search(r'(\.\.)|(\.\/)|(\/\.)|(\\\.)|(^\/)', path):
-            return None
-        
-        # Normalize the path
+        return path
+    
+    def resolve_resource_path(self, safe_path):
+        """Canonicalize a sanitized path; None if it resolves outside the resources directory"""
+        # Not cached: symlinks inside resources could change between requests
         try:
-            safe_path = os.path.normpath(path)
-            # Ensure the normalized path doesn't go outside resources directory
-            if safe_path.startswith('..') or os.path.isabs(safe_path):
-                return None
-            return safe_path
-        except:
+            file_path = os.path.realpath(os.path.join(self.resources_root, safe_path))
+        except ValueError:  # e.g. an embedded NUL byte
+            return None
+        if not file_path.startswith(self.resources_root + os.sep):
             return None
+        return file_path
     
-    def serve_html_file(self, file_path, client_socket, thread_name, request, connection_count, max_requests):
-        """Serve HTML file with text/html content type"""
+    def serve_file(self, file_path, file_stat, content_type, is_download, cache_headers, client_socket, thread_name, request, connection_count, max_requests):
+        """Serve a file, as a download (with Content-Disposition) or for display in the browser"""
         try:
-            with open(file_path, 'rb') as f:
-                content = f.read()
+            filename = os.path.basename(file_path)
             
-            content_type = "text/html; charset=utf-8"
-            self.send_successful_response(
-                client_socket, content, content_type, 
-                request, connection_count, max_requests
-            )
+            extra_headers = cache_headers
+            if is_download:
+                # Content-Disposition makes browsers download the file
+                extra_headers = b'Content-Disposition: attachment; filename="' + filename.encode() + b'"\r\n' + extra_headers
+            
+            content = self.read_cached_file(file_path, file_stat)
+            if content is not None:
+                file_size = len(content)
+                self.send_successful_response(
+                    client_socket, content, file_size, content_type, 
+                    request, connection_count, max_requests, extra_headers
+                )
+            else:
+                with open(file_path, 'rb') as f:
+                    file_size = os.fstat(f.fileno()).st_size
+                    self.send_successful_response(
+                        client_socket, f, file_size, content_type, 
+                        request, connection_count, max_requests, extra_headers
+                    )
+            
+            if is_download:
+                self.log(f"Sending binary file: {filename} ({file_size} bytes)", thread_name)
+                self.log(f"Response: 200 OK ({file_size} bytes transferred)", thread_name)
+            else:
+                self.log(f"Served HTML file: {filename} ({file_size} bytes)", thread_name)
             
-            self.log(f"Served HTML file: {os.path.basename(file_path)} ({len(content)} bytes)", thread_name)
             return self.should_keep_alive(request, connection_count, max_requests)
             
         except Exception as e:
-            self.log(f"Error serving HTML file {file_path}: {e}", thread_name)
+            self.log(f"Error serving file {file_path}: {e}", thread_name)
             self.send_error_response(client_socket, 500, "Internal Server Error")
             return False
     
-    def serve_binary_file(self, file_path, client_socket, thread_name, request, connection_count, max_requests):
-        """Serve binary file (images, text files) for download"""
-        try:
-            with open(file_path, 'rb') as f:
-                content = f.read()
-            
-            filename = os.path.basename(file_path)
-            content_type = "application/octet-stream"
-            
-            # Send response with Content-Disposition for download
-            self.send_binary_response(
-                client_socket, content, filename, 
-                request, connection_count, max_requests
-            )
-            
-            self.log(f"Sending binary file: {filename} ({len(content)} bytes)", thread_name)
-            self.log(f"Response: 200 OK ({len(content)} bytes transferred)", thread_name)
+    def read_cached_file(self, file_path, st):
+        """Return file contents from the static file cache, or None if the file is too large to cache"""
+        with self.file_cache_lock:
+            entry = self.file_cache.get(file_path)
+            if entry is not None and entry[0] == st.st_mtime_ns and len(entry[1]) == st.st_size:
+                self.file_cache.move_to_end(file_path)
+                return entry[1]
+        
+        if st.st_size > self.file_cache_max_entry:
+            return None
+        
+        # Cache miss or stale entry: load the file and evict least recently used entries
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        
+        with self.file_cache_lock:
+            old_entry = self.file_cache.pop(file_path, None)
+            if old_entry is not None:
+                self.file_cache_bytes -= len(old_entry[1])
             
-            return self.should_keep_alive(request, connection_count, max_requests)
+            self.file_cache[file_path] = (st.st_mtime_ns, content)
+            self.file_cache_bytes += len(content)
             
-        except Exception as e:
-            self.log(f"Error serving binary file {file_path}: {e}", thread_name)
-            self.send_error_response(client_socket, 500, "Internal Server Error")
-            return False
+            while self.file_cache_bytes > self.file_cache_max_bytes:
+                _, (_, evicted) = self.file_cache.popitem(last=False)
+                self.file_cache_bytes -= len(evicted)
+        
+        return content
     
     def handle_post_request(self, request, client_socket, thread_name, connection_count, max_requests):
         """Handle POST request for JSON data"""
         # Check Content-Type
-        content_type = request['headers'].get('content-type', '')
+        content_type = request.content_type
         
         if not content_type.startswith('application/json'):
             self.send_error_response(client_socket, 415, "Unsupported Media Type", "Only application/json is supported")
             return self.should_keep_alive(request, connection_count, max_requests)
         
-        # Parse JSON body
+        # Validate JSON body
         try:
-            json_data = json.loads(request['body'])
-        except json.JSONDecodeError:
+            loads_json(request.body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
             self.send_error_response(client_socket, 400, "Bad Request", "Invalid JSON data")
             return self.should_keep_alive(request, connection_count, max_requests)
         
         # Create timestamped filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        random_id = ''.join(random.choices('abcdef0123456789', k=4))
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        random_id = os.urandom(2).hex()
         filename = f"upload_{timestamp}_{random_id}.json"
         filepath = os.path.join(self.uploads_dir, filename)
         
-        # Save JSON to file
+        # Save the JSON exactly as received, so the file never depends on how it was parsed
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(json_data, f, indent=2)
+            with open(filepath, 'wb') as f:
+                f.write(request.body)
             
             # Create response
             response_data = {
@@ -517,7 +884,7 @@ class HTTPServer:
                 "filepath": f"/uploads/{filename}"
             }
             
-            response_json = json.dumps(response_data, indent=2)
+            response_json = dumps_json(response_data)
             self.send_post_response(client_socket, response_json, request, connection_count, max_requests)
             
             self.log(f"JSON file created: {filename}", thread_name)
@@ -535,91 +902,112 @@ class HTTPServer:
             return False
         
         # Check Connection header
-        connection_header = request['headers'].get('connection', '').lower()
-        version = request.get('version', 'HTTP/1.1')
+        connection_header = request.connection.lower()
+        version = request.version
         
-        if connection_header == 'close':
-            return False
-        elif connection_header == 'keep-alive':
-            return True
-        else:
+        keep_alive = self._CONNECTION_KEEP_ALIVE.get(connection_header)
+        if keep_alive is None:
             # Default behavior based on HTTP version
             return version == 'HTTP/1.1'
+        return keep_alive
     
-    def send_successful_response(self, client_socket, content, content_type, request, connection_count, max_requests):
-        """Send successful HTTP response"""
+    def send_successful_response(self, client_socket, content, content_length, content_type, request, connection_count, max_requests, extra_headers=b""):
+        """Send successful HTTP response (content is cached bytes or an open file)"""
         keep_alive = self.should_keep_alive(request, connection_count, max_requests)
         
-        response = f"HTTP/1.1 200 OK\r\n"
-        response += f"Content-Type: {content_type}\r\n"
-        response += f"Content-Length: {len(content)}\r\n"
-        response += f"Date: {self.get_http_date()}\r\n"
-        response += f"Server: {self.server_name}\r\n"
-        response += f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
-        
-        if keep_alive:
-            response += "Keep-Alive: timeout=30, max=100\r\n"
+        headers = self.build_response_headers(self._RESP_200, content_type, content_length, keep_alive, extra_headers)
         
-        response += "\r\n"
-        
-        # Send headers
-        self.send_all(client_socket, response.encode())
-        # Send content
-        self.send_all(client_socket, content)
+        # Send headers and content
+        self.send_content(client_socket, headers, content, content_length)
     
     def send_all(self, client_socket, data):
         """Ensure all data is sent through the socket"""
-        total_sent = 0
-        while total_sent < len(data):
-            try:
-                sent = client_socket.send(data[total_sent:])
-                if sent == 0:
-                    raise RuntimeError("Socket connection broken")
-                total_sent += sent
-            except socket.error:
-                raise RuntimeError("Failed to send data")
-    
-    def send_binary_response(self, client_socket, content, filename, request, connection_count, max_requests):
-        """Send binary file response with download headers"""
-        keep_alive = self.should_keep_alive(request, connection_count, max_requests)
-        
-        response = f"HTTP/1.1 200 OK\r\n"
-        response += f"Content-Type: application/octet-stream\r\n"
-        response += f"Content-Length: {len(content)}\r\n"
-        response += f"Content-Disposition: attachment; filename=\"{filename}\"\r\n"
-        response += f"Date: {self.get_http_date()}\r\n"
-        response += f"Server: {self.server_name}\r\n"
-        response += f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        # socket.sendall retries partial sends in C, without slicing the data each time
+        try:
+            client_socket.sendall(data)
+        except socket.error:
+            raise RuntimeError("Failed to send data")
+    
+    def send_gathered(self, client_socket, headers, body):
+        """Send headers and body with a single gathered write where supported"""
+        if not hasattr(client_socket, 'sendmsg'):
+            self.send_all(client_socket, headers)
+            self.send_all(client_socket, body)
+            return
         
-        if keep_alive:
-            response += "Keep-Alive: timeout=30, max=100\r\n"
+        try:
+            sent = client_socket.sendmsg([headers, body])
+        except socket.error:
+            raise RuntimeError("Failed to send data")
         
-        response += "\r\n"
+        # Finish a partial write with ordinary sends
+        if sent < len(headers):
+            self.send_all(client_socket, memoryview(headers)[sent:])
+            self.send_all(client_socket, body)
+        else:
+            self.send_all(client_socket, memoryview(body)[sent - len(headers):])
+    
+    def send_content(self, client_socket, headers, content, content_length):
+        """Send response headers and a body held in memory or, for open files, straight from the file"""
+        if isinstance(content, bytes):
+            self.send_gathered(client_socket, headers, content)
+            return
         
-        # Send headers
-        self.send_all(client_socket, response.encode())
-        # Send binary content in chunks for large files
-        self.send_all(client_socket, content)
+        # Cork the socket so the headers leave in the same segment as the start of the file
+        cork = hasattr(socket, 'TCP_CORK')
+        if cork:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        try:
+            self.send_all(client_socket, headers)
+            self.send_file(client_socket, content, content_length)
+        finally:
+            if cork:
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+    
+    def send_file(self, client_socket, file_obj, content_length):
+        """Send file contents through the socket without copying them into Python"""
+        # socket.sendfile uses os.sendfile when possible and falls back to
+        # read()/send() internally for sockets that can't use it (e.g. TLS)
+        try:
+            sent = client_socket.sendfile(file_obj, 0, content_length)
+        except socket.error:
+            raise RuntimeError("Failed to send data")
+        if sent != content_length:
+            raise RuntimeError("Socket connection broken")
     
     def send_post_response(self, client_socket, json_content, request, connection_count, max_requests):
         """Send POST response"""
         keep_alive = self.should_keep_alive(request, connection_count, max_requests)
         
-        response = f"HTTP/1.1 201 Created\r\n"
-        response += f"Content-Type: application/json\r\n"
-        response += f"Content-Length: {len(json_content.encode())}\r\n"
-        response += f"Date: {self.get_http_date()}\r\n"
-        response += f"Server: {self.server_name}\r\n"
-        response += f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
-        
-        if keep_alive:
-            response += "Keep-Alive: timeout=30, max=100\r\n"
-        
-        response += "\r\n"
+        headers = self.build_response_headers(self._RESP_201, self._TYPE_JSON, len(json_content), keep_alive)
         
         # Send response
-        self.send_all(client_socket, response.encode())
-        self.send_all(client_socket, json_content.encode())
+        self.send_gathered(client_socket, headers, json_content)
+    
+    def send_not_modified_response(self, client_socket, cache_headers, request, connection_count, max_requests):
+        """Send 304 Not Modified response (validators only, no body)"""
+        keep_alive = self.should_keep_alive(request, connection_count, max_requests)
+        
+        headers = self.build_response_headers(self._RESP_304, None, 0, keep_alive, cache_headers)
+        self.send_all(client_socket, headers)
+    
+    def build_response_headers(self, status_line, content_type, content_length, keep_alive, extra_headers=b""):
+        """Assemble response headers from precomputed byte fragments (no content headers if content_type is None)"""
+        headers = bytearray(status_line)
+        if content_type is not None:
+            headers += b"Content-Type: "
+            headers += content_type
+            headers += b"\r\nContent-Length: "
+            headers += str(content_length).encode()
+            headers += b"\r\n"
+        headers += extra_headers
+        headers += b"Date: "
+        headers += self.get_http_date()
+        headers += b"\r\n"
+        headers += self.server_header
+        headers += self._CONN_KEEP_ALIVE if keep_alive else self._CONN_CLOSE
+        headers += b"\r\n"
+        return headers
     
     def send_error_response(self, client_socket, status_code, status_text, message=""):
         """Send HTTP error response"""
@@ -640,27 +1028,26 @@ class HTTPServer:
 </body>
 </html>"""
             
-            response = f"HTTP/1.1 {status_code} {status_text}\r\n"
-            response += f"Content-Type: text/html; charset=utf-8\r\n"
-            response += f"Content-Length: {len(html_content.encode())}\r\n"
-            response += f"Date: {self.get_http_date()}\r\n"
-            response += f"Server: {self.server_name}\r\n"
-            response += f"Connection: close\r\n"
+            body = html_content.encode()
+            status_line = f"HTTP/1.1 {status_code} {status_text}\r\n".encode()
+            extra_headers = b"Retry-After: 60\r\n" if status_code == 503 else b""
+            headers = self.build_response_headers(status_line, self._TYPE_HTML, len(body), False, extra_headers)
             
-            if status_code == 503:
-                response += "Retry-After: 60\r\n"
-            
-            response += "\r\n"
-            
-            self.send_all(client_socket, response.encode())
-            self.send_all(client_socket, html_content.encode())
+            self.send_gathered(client_socket, headers, body)
             
         except Exception:
             pass  # Ignore errors when sending error responses
     
     def get_http_date(self):
-        """Get current date in RFC 7231 format"""
-        return time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
+        """Get current date in RFC 7231 format as bytes (cached, HTTP dates have 1 second resolution)"""
+        global _date_cache
+        now = int(time.time())
+        cached_second, cached_date = _date_cache
+        if cached_second != now:
+            cached_date = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(now)).encode()
+            # Replace the pair as a whole so other threads never see a mismatched second/date
+            _date_cache = (now, cached_date)
+        return cached_date
     
     def stop(self):
         """Stop the server gracefully"""
@@ -672,9 +1059,29 @@ class HTTPServer:
             except:
                 pass
         
+        for wakeup_socket in (self.wakeup_recv, self.wakeup_send):
+            if wakeup_socket:
+                try:
+                    wakeup_socket.close()
+                except:
+                    pass
+        
         # Signal worker threads to stop
         for _ in range(self.max_threads):
-            self.connection_queue.put((None, None))
+            self.connection_queue.put((None, None, 0))
+        
+        # Stop and reap forked worker processes
+        for pid in self.child_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self.child_pids:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.child_pids = []
         
         self.log("Server stopped")
 
@@ -685,6 +1092,7 @@ def main():
     host = '127.0.0.1'
     port = 8080
     max_threads = 10
+    processes = 1
     
     if len(sys.argv) >= 2:
         try:
@@ -705,8 +1113,17 @@ def main():
             print(f"Invalid thread count: {e}")
             sys.exit(1)
     
+    if len(sys.argv) >= 5:
+        try:
+            processes = int(sys.argv[4])
+            if processes <= 0:
+                raise ValueError("Process count must be positive")
+        except ValueError as e:
+            print(f"Invalid process count: {e}")
+            sys.exit(1)
+    
     # Create and start server
-    server = HTTPServer(host, port, max_threads)
+    server = HTTPServer(host, port, max_threads, processes)
     
     try:
         server.start()